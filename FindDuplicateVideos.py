@@ -1,6 +1,6 @@
 import sys
 import os
-import cv2
+import asyncio
 import numpy as np
 import torch
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
@@ -10,15 +10,51 @@ from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from PyQt6.QtGui import QImage, QPixmap
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess
-import tempfile
-import shutil
-import imagehash
-from PIL import Image
+import sqlite3
 import random
 import collections
-import pathlib
+import math
 import time
 
+try:
+    import av  # PyAV reads container metadata in-process
+except ImportError:  # Fall back to the ffmpeg/ffprobe command line tools
+    av = None
+
+# Bands of the 64-bit frame hash as (shift, mask). Two hashes within the
+# 4-bit match tolerance always agree on at least one of these five bands.
+HASH_BANDS = [(51, 0x1FFF), (38, 0x1FFF), (25, 0x1FFF), (12, 0x1FFF), (0, 0xFFF)]
+
+# Side length of the RGB thumbnails the decoders produce for hashing
+FRAME_SIZE = 8
+
+# Number of analyzed videos whose frames are hashed together in one batch
+HASH_BATCH_VIDEOS = 64
+
+# Analysis results keyed by path, size and mtime, reused across scans
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.fastduplicates_cache.sqlite')
+
+# Hash format of cached rows. Bump whenever _ahash_batch, hash_frames,
+# sample_timestamps or the decoder scaling change, so stale hashes are dropped.
+CACHE_VERSION = 2
+
+# Width of the log-duration bins, so videos within 10% land in adjacent bins
+DURATION_BIN_WIDTH = -math.log(0.90)
+
+def _ahash_batch(frames_u8):
+    """Compute 64-bit average hashes for a (N, H, W, 3) uint8 frame batch, H and W multiples of 8"""
+    n, h, w = frames_u8.shape[:3]
+    # Integer BT.601 luma, (77R + 150G + 29B) >> 8, stays within uint16
+    rgb = frames_u8.astype(np.uint16)
+    gray = ((77 * rgb[..., 0] + 150 * rgb[..., 1] + 29 * rgb[..., 2]) >> 8).astype(np.uint8)
+    
+    # Sum blocks down to an 8x8 thumbnail (a no-op for 8x8 input)
+    pooled = gray.reshape(n, 8, h // 8, 8, w // 8).sum(axis=(2, 4))
+    bits = pooled > pooled.mean(axis=(1, 2), keepdims=True)
+    
+    # Pack row-major bits into one big-endian uint64 per frame
+    return np.packbits(bits.reshape(n, 64), axis=1).view('>u8').ravel().astype(np.uint64)
+
 class VideoHasher(QThread):
     progress = pyqtSignal(int)
     groups_found = pyqtSignal(dict, dict, dict)
@@ -29,125 +65,292 @@ class VideoHasher(QThread):
         super().__init__()
         self.video_paths = video_paths
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.duration_cache = {}  # Durations probed up front when PyAV is missing
+        self.pool = ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 1))
 
-    def extract_frames(self, video_path, timestamps):
-        """Extract multiple frames at specified timestamps and store in memory"""
+    def _decode_at(self, container, stream, ts):
+        """Decode the first frame at or after a timestamp with PyAV, or None past the end"""
+        # Timestamps are relative to the start of the file, like ffmpeg's -ss
+        target = ts + (container.start_time or 0) / av.time_base
+        
+        # Jump to the keyframe before the timestamp, then decode forward to it
+        container.seek(int(target * av.time_base), backward=True, any_frame=False)
+        for frame in container.decode(stream):
+            if frame.time is not None and frame.time >= target:
+                return frame
+        return None
+
+    def _extract_via_pyav(self, container, timestamps):
+        """Decode frames at specified timestamps from an open PyAV container"""
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'  # Let libav decode with its own threads
+        
         frames = {}
-        temp_dir = tempfile.mkdtemp()
+        for ts in timestamps:
+            frame = self._decode_at(container, stream, ts)
+            if frame is None:
+                break  # Ran past the end of the video
+            frames[ts] = frame.reformat(
+                width=FRAME_SIZE, height=FRAME_SIZE, format='rgb24', interpolation='AREA'
+            ).to_ndarray()
+        
+        return frames if frames else None
+
+    def extract_frames(self, video_path, timestamps):
+        """Extract frames at the given timestamps with one ffmpeg call when PyAV is missing"""
+        # Open the video once per timestamp with input seeking, so each input only
+        # decodes from the nearest keyframe, then keep one frame of each and concat them
+        cmd = ['ffmpeg']
+        for ts in timestamps:
+            cmd += ['-ss', str(ts), '-i', video_path]
+        filters = [
+            f'[{i}:v:0]trim=end_frame=1,scale={FRAME_SIZE}:{FRAME_SIZE}:flags=area,setsar=1[f{i}]'
+            for i in range(len(timestamps))
+        ]
+        segments = ''.join(f'[f{i}]' for i in range(len(timestamps)))
+        filters.append(f'{segments}concat=n={len(timestamps)}:v=1:a=0[out]')
+        cmd += [
+            '-filter_complex', ';'.join(filters),
+            '-map', '[out]',
+            '-vsync', 'vfr',
+            '-f', 'rawvideo',  # Raw frames, no JPEG round-trip
+            '-pix_fmt', 'rgb24',  # Use RGB format
+            'pipe:'  # Output to stdout
+        ]
         
         try:
-            for ts in timestamps:
-                frame_path = os.path.join(temp_dir, f'frame_{ts}.jpg')
-                cmd = [
-                    'ffmpeg', '-ss', str(ts),
-                    '-i', video_path,
-                    '-vframes', '1',
-                    '-q:v', '2',
-                    '-f', 'image2pipe',  # Output to pipe
-                    '-pix_fmt', 'rgb24',  # Use RGB format
-                    'pipe:'  # Output to stdout
-                ]
-                
-                # Run ffmpeg and capture output directly
-                result = subprocess.run(cmd, capture_output=True)
-                
-                if result.returncode == 0:
-                    # Convert bytes to numpy array
-                    frame_array = np.frombuffer(result.stdout, dtype=np.uint8)
-                    if len(frame_array) > 0:
-                        # Decode image from memory
-                        frame = cv2.imdecode(frame_array, cv2.IMREAD_COLOR)
-                        if frame is not None:
-                            # Convert to PIL Image for hashing
-                            pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                            frames[ts] = {
-                                'pil': pil_image,
-                                'cv2': frame
-                            }
-                    
-            return frames if frames else None
+            # Run ffmpeg and capture output directly
+            result = subprocess.run(cmd, capture_output=True)
+            if result.returncode != 0:
+                return None
+            
+            # Frames arrive back to back in timestamp order
+            frame_size = FRAME_SIZE * FRAME_SIZE * 3
+            count = min(len(result.stdout) // frame_size, len(timestamps))
+            if count == 0:
+                return None
+            frames = np.frombuffer(result.stdout[:count * frame_size], dtype=np.uint8)
+            frames = frames.reshape(count, FRAME_SIZE, FRAME_SIZE, 3)
+            return dict(zip(timestamps, frames))
             
         except Exception as e:
             self.error_occurred.emit(f"Error extracting frames from {os.path.basename(video_path)}: {str(e)}")
             return None
-        finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
 
-    def compute_frame_hash(self, pil_image):
-        """Compute perceptual hash of a frame"""
-        # Resize to reasonable dimensions for hashing
-        pil_image = pil_image.resize((64, 64), Image.Resampling.LANCZOS)
-        return imagehash.average_hash(pil_image)
+    def extract_preview(self, video_path, ts):
+        """Extract a single full resolution RGB frame for the group preview"""
+        try:
+            if av is not None:
+                with av.open(video_path) as container:
+                    frame = self._decode_at(container, container.streams.video[0], ts)
+                    return frame.to_ndarray(format='rgb24') if frame is not None else None
+            
+            cmd = [
+                'ffmpeg', '-ss', str(ts),
+                '-i', video_path,
+                '-vframes', '1',
+                '-f', 'image2pipe',  # Output to pipe
+                '-c:v', 'ppm',  # Uncompressed RGB with a small text header
+                '-pix_fmt', 'rgb24',  # 8 bits per channel, even for 10-bit sources
+                'pipe:'  # Output to stdout
+            ]
+            result = subprocess.run(cmd, capture_output=True)
+            if result.returncode != 0 or not result.stdout:
+                return None
+            
+            # Header is "P6 <width> <height> <maxval>", pixel data follows
+            _, w, h, maxval = result.stdout.split(maxsplit=4)[:4]
+            w, h = int(w), int(h)
+            if maxval != b'255' or len(result.stdout) < w * h * 3:
+                return None
+            return np.frombuffer(result.stdout[-w * h * 3:], dtype=np.uint8).reshape(h, w, 3)
+        except Exception as e:
+            self.error_occurred.emit(f"Error extracting preview from {os.path.basename(video_path)}: {str(e)}")
+            return None
 
     def get_video_duration(self, video_path):
-        """Get video duration using ffprobe"""
-        cmd = [
+        """Get video duration using ffprobe when PyAV is missing"""
+        try:
+            result = subprocess.run(self._probe_cmd(video_path), capture_output=True, text=True)
+            return float(result.stdout.strip())
+        except:
+            return 0
+
+    def _probe_cmd(self, video_path):
+        """Build the ffprobe command that prints a video's duration"""
+        return [
             'ffprobe',
             '-v', 'error',
             '-show_entries', 'format=duration',
             '-of', 'default=noprint_wrappers=1:nokey=1',
             video_path
         ]
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return float(result.stdout.strip())
-        except:
-            return 0
 
-    def analyze_video(self, video_path):
-        """Analyze video by sampling multiple frames"""
-        self.status_update.emit(f"Analyzing: {os.path.basename(video_path)}")
+    async def _probe_many(self, paths):
+        """Get durations of many videos with concurrent ffprobe processes"""
+        semaphore = asyncio.Semaphore((os.cpu_count() or 4) * 2)
         
-        duration = self.get_video_duration(video_path)
-        if duration < 10:  # Skip very short videos
-            return None
-            
-        # Calculate sampling points
+        async def probe(path):
+            async with semaphore:
+                try:
+                    proc = await asyncio.create_subprocess_exec(
+                        *self._probe_cmd(path),
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.DEVNULL
+                    )
+                    stdout, _ = await proc.communicate()
+                    return path, float(stdout.decode().strip())
+                except (OSError, ValueError):
+                    return path, 0
+        
+        return dict(await asyncio.gather(*(probe(path) for path in paths)))
+
+    def sample_timestamps(self, duration):
+        """Calculate the sampling points for a video of the given duration"""
         # Skip first 30 seconds (to avoid title cards) and last 30 seconds (to avoid credits)
         start_time = min(30, duration * 0.1)  # 30 seconds or 10% of video
         end_time = max(0, duration - 30)  # 30 seconds from end
         
         if end_time <= start_time:
-            return None
+            return []
             
         # Sample 5 points from the main content of the video
         sample_duration = end_time - start_time
-        timestamps = [
+        return [
             start_time + (sample_duration * 0.2),  # 20% through main content
             start_time + (sample_duration * 0.4),  # 40% through main content
             start_time + (sample_duration * 0.6),  # 60% through main content
             start_time + (sample_duration * 0.8),  # 80% through main content
             start_time + (sample_duration * 0.9)   # 90% through main content
         ]
+
+    def _analysis_timestamps(self, duration):
+        """Get the sampling points to analyze, or an empty list for videos too short to compare"""
+        if duration < 10:  # Skip very short videos
+            return []
+        return self.sample_timestamps(duration)
+
+    def analyze_video(self, video_path):
+        """Analyze video by sampling multiple frames"""
+        self.status_update.emit(f"Analyzing: {os.path.basename(video_path)}")
+        
+        if av is not None:
+            # Read the duration and decode the frames from a single open of the container
+            try:
+                with av.open(video_path) as container:
+                    duration = (container.duration or 0) / av.time_base
+                    timestamps = self._analysis_timestamps(duration)
+                    frames = self._extract_via_pyav(container, timestamps) if timestamps else None
+            except Exception as e:
+                self.error_occurred.emit(f"Error extracting frames from {os.path.basename(video_path)}: {str(e)}")
+                return None
+        else:
+            duration = self.duration_cache.get(video_path)
+            if duration is None:
+                duration = self.get_video_duration(video_path)
+            timestamps = self._analysis_timestamps(duration)
+            frames = self.extract_frames(video_path, timestamps) if timestamps else None
         
-        frames = self.extract_frames(video_path, timestamps)
         if not frames or len(frames) < 3:  # Require at least 3 successful frame extractions
             return None
             
-        # Compute hashes for each frame
-        frame_hashes = {ts: self.compute_frame_hash(frames[ts]['pil']) for ts in frames}
-        
-        # Store the first frame for preview
-        preview_frame = frames[timestamps[0]]['cv2']
-        
+        # Frames are hashed in batches across videos by hash_pending
         return {
             'duration': duration,
-            'frame_hashes': frame_hashes,
-            'preview': preview_frame
+            'frames': frames
         }
-            
-        # Compute hashes for each frame
-        frame_hashes = {ts: self.compute_frame_hash(frame) for ts, frame in frames.items()}
+
+    def hash_frames(self, frames_u8):
+        """Hash a (N, H, W, 3) frame batch on the GPU when available, otherwise with NumPy"""
+        if self.device.type != 'cuda':
+            return _ahash_batch(frames_u8)
+        
+        # Same integer luma as _ahash_batch so both paths produce identical hashes
+        t = torch.from_numpy(frames_u8).to(self.device, non_blocking=True).int()
+        gray = ((77 * t[..., 0] + 150 * t[..., 1] + 29 * t[..., 2]) >> 8).float()
+        
+        # Average blocks down to an 8x8 thumbnail (a no-op for 8x8 input)
+        block = (gray.shape[-2] // 8, gray.shape[-1] // 8)
+        pooled = torch.nn.functional.avg_pool2d(gray.unsqueeze(1), block).flatten(1)
+        bits = pooled > pooled.mean(dim=1, keepdim=True)
+        
+        # Pack row-major bits the same way as _ahash_batch; the top bit wraps to the int64 sign
+        shifts = torch.arange(63, -1, -1, device=self.device)
+        packed = (bits.long() << shifts).sum(dim=1)
+        return packed.cpu().numpy().view(np.uint64)
+
+    def hash_pending(self, pending, video_data):
+        """Hash the frames of all pending videos in one batch and store the results"""
+        if not pending:
+            return
         
-        # Save first frame as preview
-        preview_frame = cv2.imread(os.path.join(tempfile.gettempdir(), f'frame_{timestamps[0]}.jpg'))
+        try:
+            batch = np.stack([frame for _, data in pending for frame in data['frames'].values()])
+            try:
+                hashes = self.hash_frames(batch)
+            except Exception as e:
+                if self.device.type != 'cuda':
+                    raise
+                # Device failures such as out-of-memory fall back to the CPU kernel
+                self.error_occurred.emit(f"GPU hashing failed, using CPU: {str(e)}")
+                hashes = _ahash_batch(batch)
+            
+            offset = 0
+            for path, data in pending:
+                count = len(data['frames'])
+                video_data[path] = {
+                    'duration': data['duration'],
+                    'frame_hashes': hashes[offset:offset + count]
+                }
+                offset += count
+        except Exception as e:
+            self.error_occurred.emit(f"Error hashing frames of {len(pending)} videos: {str(e)}")
+        finally:
+            pending.clear()
+
+    def _open_cache(self):
+        """Open the analysis cache, or return None if it is unavailable"""
+        try:
+            cache = sqlite3.connect(CACHE_PATH)
+            
+            # Discard rows written by an older hash format
+            if cache.execute('PRAGMA user_version').fetchone()[0] != CACHE_VERSION:
+                with cache:
+                    cache.execute('DROP TABLE IF EXISTS videos')
+                    cache.execute(f'PRAGMA user_version = {CACHE_VERSION}')
+            
+            cache.execute(
+                'CREATE TABLE IF NOT EXISTS videos '
+                '(path TEXT PRIMARY KEY, size INT, mtime REAL, dur REAL, hashes BLOB)'
+            )
+            return cache
+        except sqlite3.Error as e:
+            self.error_occurred.emit(f"Analysis cache unavailable: {str(e)}")
+            return None
+
+    def _cache_get(self, cache, path, size, mtime):
+        """Look up cached analysis results for an unchanged file"""
+        row = cache.execute(
+            'SELECT dur, hashes FROM videos WHERE path = ? AND size = ? AND mtime = ?',
+            (path, size, mtime)
+        ).fetchone()
+        if row is None:
+            return None
         
+        duration, blob = row
         return {
             'duration': duration,
-            'frame_hashes': frame_hashes,
-            'preview': preview_frame
+            'frame_hashes': np.frombuffer(blob, dtype=np.uint64)
         }
 
+    def _cache_put(self, cache, path, size, mtime, data):
+        """Store analysis results for a file"""
+        hashes = np.asarray(data['frame_hashes'], dtype=np.uint64)
+        cache.execute(
+            'INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?)',
+            (path, size, mtime, data['duration'], hashes.tobytes())
+        )
+
     def are_videos_similar(self, data1, data2):
         """Compare two videos based on multiple frame hashes"""
         # Duration check first
@@ -155,100 +358,154 @@ class VideoHasher(QThread):
         if duration_ratio < 0.90:  # Allow 10% duration difference
             return False
         
-        # Compare frame hashes
-        matching_frames = 0
-        total_comparisons = 0
-        
-        # Compare frames at similar timestamps
-        for ts1, hash1 in data1['frame_hashes'].items():
-            # Find closest timestamp in second video
-            closest_ts2 = min(data2['frame_hashes'].keys(), key=lambda x: abs(x - ts1))
-            hash2 = data2['frame_hashes'][closest_ts2]
-            
-            # Compare hashes with a small tolerance
-            if hash1 - hash2 <= 4:  # Allow small differences
-                matching_frames += 1
-            total_comparisons += 1
+        # Require at least 80% of frames to match; unmatched extra frames count as misses
+        hashes1, hashes2 = data1['frame_hashes'], data2['frame_hashes']
+        total = max(len(hashes1), len(hashes2))
+        misses_allowed = total // 5 - abs(len(hashes1) - len(hashes2))
+        if misses_allowed < 0:
+            return False
         
-        # Require at least 80% of frames to match
-        return (matching_frames / total_comparisons) >= 0.8
+        # Compare frames at the same sampling positions, stopping once too many differ
+        for hash1, hash2 in zip(hashes1, hashes2):
+            if (int(hash1) ^ int(hash2)).bit_count() > 4:  # Allow small differences
+                misses_allowed -= 1
+                if misses_allowed < 0:
+                    return False
+        return True
+
+    def bucket_keys(self, data):
+        """Get the LSH bucket keys of a video as (duration bin, band, band value)"""
+        dur_bin = int(math.log(data['duration']) // DURATION_BIN_WIDTH)
+        return {
+            (dur_bin, band, (int(frame_hash) >> shift) & mask)
+            for frame_hash in data['frame_hashes']
+            for band, (shift, mask) in enumerate(HASH_BANDS)
+        }
 
     def find_duplicate_groups(self):
         """Find groups of duplicate videos using parallel video processing"""
         # Initialize data structures
-        groups = []
         video_data = {}
         
         total_videos = len(self.video_paths)
         processed = 0
-        
-        # First pass: Analyze videos in parallel
-        with ThreadPoolExecutor(max_workers=8) as executor:
-            # Submit all video analysis jobs
-            future_to_path = {
-                executor.submit(self.analyze_video, path): path 
-                for path in self.video_paths
-            }
+        pending = []  # Analyzed videos waiting for their frames to be hashed
+        
+        # Reuse results for files that have not changed since the last scan
+        cache = self._open_cache()
+        to_analyze = {}
+        for path in self.video_paths:
+            try:
+                stat = os.stat(path)
+                file_key = (stat.st_size, stat.st_mtime)
+                data = self._cache_get(cache, path, *file_key) if cache is not None else None
+            except (OSError, sqlite3.Error):
+                file_key, data = None, None
             
-            # Process results as they complete
-            for future in as_completed(future_to_path):
-                path = future_to_path[future]
-                try:
-                    data = future.result()
-                    if data is not None:
-                        video_data[path] = data
-                except Exception as e:
-                    self.error_occurred.emit(f"Error analyzing {os.path.basename(path)}: {str(e)}")
-                
+            if data is not None:
+                video_data[path] = data
                 processed += 1
-                self.progress.emit(int(processed * 50 / total_videos))
+            else:
+                to_analyze[path] = file_key
+        self.progress.emit(int(processed * 50 / total_videos))
         
-        # Second pass: Group similar videos with parallel comparison
-        remaining_videos = set(video_data.keys())
-        total_comparisons = len(remaining_videos)
-        processed = 0
+        # Without PyAV, probe all durations at once instead of one ffprobe per worker
+        if av is None and to_analyze:
+            self.status_update.emit("Reading video durations...")
+            self.duration_cache = asyncio.run(self._probe_many(list(to_analyze)))
         
-        while remaining_videos:
-            video_path = remaining_videos.pop()
-            current_group = {video_path}
-            
-            # Process comparisons in parallel
-            compare_with = list(remaining_videos)
-            with ThreadPoolExecutor(max_workers=8) as executor:
-                future_to_path = {
-                    executor.submit(
-                        self.are_videos_similar, 
-                        video_data[video_path], 
-                        video_data[other_path]
-                    ): other_path
-                    for other_path in compare_with
-                }
-                
-                for future in as_completed(future_to_path):
-                    other_path = future_to_path[future]
-                    try:
-                        if future.result():
-                            current_group.add(other_path)
-                            remaining_videos.remove(other_path)
-                    except Exception as e:
-                        self.error_occurred.emit(f"Error comparing videos: {str(e)}")
+        # First pass: Analyze videos in parallel
+        # Submit all video analysis jobs to the shared pool
+        future_to_path = {
+            self.pool.submit(self.analyze_video, path): path 
+            for path in to_analyze
+        }
+        
+        # Process results as they complete
+        for future in as_completed(future_to_path):
+            path = future_to_path[future]
+            try:
+                data = future.result()
+                if data is not None:
+                    pending.append((path, data))
+            except Exception as e:
+                self.error_occurred.emit(f"Error analyzing {os.path.basename(path)}: {str(e)}")
             
-            if len(current_group) > 1:
-                groups.append(current_group)
+            # hash_pending reports its own errors and always empties the batch
+            if len(pending) >= HASH_BATCH_VIDEOS:
+                self.hash_pending(pending, video_data)
             
             processed += 1
-            self.progress.emit(50 + int(processed * 50 / total_comparisons))
-        
-        # Create preview images
+            self.progress.emit(int(processed * 50 / total_videos))
+        
+        self.hash_pending(pending, video_data)
+        
+        # Remember newly analyzed videos for the next scan
+        if cache is not None:
+            try:
+                with cache:
+                    for path, file_key in to_analyze.items():
+                        if file_key is not None and path in video_data:
+                            self._cache_put(cache, path, *file_key, video_data[path])
+            except sqlite3.Error as e:
+                self.error_occurred.emit(f"Error updating analysis cache: {str(e)}")
+            cache.close()
+        
+        # Second pass: Bucket videos so only likely matches get compared
+        paths = list(video_data)
+        video_keys = [self.bucket_keys(video_data[path]) for path in paths]
+        buckets = collections.defaultdict(set)
+        for i, keys in enumerate(video_keys):
+            for key in keys:
+                buckets[key].add(i)
+        
+        # Group similar videos with union-find, so matches chain across pairs
+        parent = list(range(len(paths)))
+        
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]  # Path halving
+                i = parent[i]
+            return i
+        
+        for i in range(len(paths)):
+            # Candidates share a hash band in the same or a neighbouring duration bin
+            compare_with = set()
+            for dur_bin, band, value in video_keys[i]:
+                for nearby_bin in (dur_bin - 1, dur_bin, dur_bin + 1):
+                    compare_with |= buckets.get((nearby_bin, band, value), set())
+            
+            # Check each pair once, skipping videos already in the same group
+            compare_with = [j for j in compare_with if j > i and find(j) != find(i)]
+            
+            # Comparisons are cheap integer work, so run them inline
+            for j in compare_with:
+                try:
+                    if find(i) != find(j) and self.are_videos_similar(video_data[paths[i]], video_data[paths[j]]):
+                        parent[find(j)] = find(i)
+                except Exception as e:
+                    self.error_occurred.emit(f"Error comparing videos: {str(e)}")
+            
+            self.progress.emit(50 + int((i + 1) * 50 / len(paths)))
+        
+        members = collections.defaultdict(set)
+        for i, path in enumerate(paths):
+            members[find(i)].add(path)
+        groups = [group for group in members.values() if len(group) > 1]
+        
+        # Create preview images; only the first member of each group needs a full resolution frame
+        first_videos = [next(iter(group)) for group in groups]
+        preview_frames = self.pool.map(
+            lambda path: self.extract_preview(path, self.sample_timestamps(video_data[path]['duration'])[0]),
+            first_videos
+        )
         group_previews = {}
-        for group in groups:
-            first_video = next(iter(group))
-            preview_frame = video_data[first_video]['preview']
+        for group, preview_frame in zip(groups, preview_frames):
             if preview_frame is not None:
-                preview_frame = cv2.cvtColor(preview_frame, cv2.COLOR_BGR2RGB)
                 h, w, ch = preview_frame.shape
                 q_img = QImage(preview_frame.data, w, h, ch * w, QImage.Format.Format_RGB888)
-                group_previews[tuple(group)] = q_img
+                # QImage does not copy the pixels, so keep the array alongside it
+                group_previews[tuple(group)] = (q_img, preview_frame)
         
         self.status_update.emit("Analysis complete!")
         self.progress.emit(100)
@@ -262,6 +519,8 @@ class VideoHasher(QThread):
             self.groups_found.emit(dict(enumerate(groups)), previews, video_data)
         except Exception as e:
             self.error_occurred.emit(f"Error during processing: {str(e)}")
+        finally:
+            self.pool.shutdown()
 
 class ClickableLabel(QLabel):
     clicked = pyqtSignal()
@@ -357,24 +616,25 @@ class MainWindow(QMainWindow):
         return f"{hours}h {minutes}m"
 
     def get_video_files_from_folder(self, folder_path):
-        """Recursively get all video files from a folder"""
-        video_extensions = {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm'}
-        video_files = []
-        
-        try:
-            # Count all video files first
-            total_files = sum(1 for path in pathlib.Path(folder_path).rglob('*') 
-                            if path.suffix.lower() in video_extensions)
-            self.status_label.setText(f"Found {total_files} video files in folder...")
-            
-            # Then collect them
-            for path in pathlib.Path(folder_path).rglob('*'):
-                if path.suffix.lower() in video_extensions:
-                    video_files.append(str(path))
-        except Exception as e:
-            self.error_label.setText(f"Error scanning folder {folder_path}: {str(e)}")
-            
-        return video_files
+        """Recursively yield all video files from a folder in a single pass"""
+        video_extensions = ('.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm')
+        total_files = 0
+        folders = [folder_path]
+        
+        while folders:
+            current = folders.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(entry.path)
+                        elif entry.name.lower().endswith(video_extensions):
+                            total_files += 1
+                            yield entry.path
+            except OSError as e:
+                self.error_label.setText(f"Error scanning folder {current}: {str(e)}")
+        
+        self.status_label.setText(f"Found {total_files} video files in folder...")
         
     def update_selected_sources_display(self):
         """Update the display of selected sources"""
@@ -469,7 +729,8 @@ class MainWindow(QMainWindow):
             group_tuple = tuple(files)
             if group_tuple in previews:
                 preview_label = QLabel()
-                pixmap = QPixmap.fromImage(previews[group_tuple])
+                q_img, _ = previews[group_tuple]
+                pixmap = QPixmap.fromImage(q_img)
                 pixmap = pixmap.scaled(200, 200, Qt.AspectRatioMode.KeepAspectRatio)
                 preview_label.setPixmap(pixmap)
                 group_layout.addWidget(preview_label)
@@ -502,7 +763,8 @@ class MainWindow(QMainWindow):
             group_tuple = tuple(files)
             if group_tuple in previews:
                 preview_label = QLabel()
-                pixmap = QPixmap.fromImage(previews[group_tuple])
+                q_img, _ = previews[group_tuple]
+                pixmap = QPixmap.fromImage(q_img)
                 pixmap = pixmap.scaled(200, 200, Qt.AspectRatioMode.KeepAspectRatio)
                 preview_label.setPixmap(pixmap)
                 group_layout.addWidget(preview_label)